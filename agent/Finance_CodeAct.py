@@ -16,9 +16,9 @@ Date: February 22, 2025
 
 import re
 import json
+import time
 import pathlib
 from termcolor import colored
-from transformers import AutoTokenizer
 from typing import List, Dict
 from datetime import datetime
 from jupyter_client import KernelManager
@@ -26,6 +26,11 @@ from queue import Empty
 from openai import OpenAI
 import textwrap
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Initialize OpenAI client
 client = OpenAI(
     base_url='https://api.openai.com/v1',
@@ -65,6 +70,118 @@ The assistant should stop <execute> and provide an answer when they have already
 
 The assistant's response should be concise, but do express their thoughts about investment strategies and market analysis, particularly focusing on the technology sector since this is a tech-focused fund."""
 
+# Code run in every new kernel to expose the fund management tools
+_INIT_CODE = textwrap.dedent("""
+    import os
+    import sys
+
+    # Use the parent directory as the project root (assuming this script is in 'agent')
+    project_root = os.path.abspath(os.path.join(os.getcwd(), ".."))
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+    os.chdir(project_root)
+
+    from fund_manager.fund_manager import (
+        init_db,
+        create_fund,
+        buy_shares,
+        sell_shares,
+        get_fund_composition,
+        update_fund,
+        update_all_funds
+    )
+    from fund_manager.yfinance_utils import fetch_live_price
+
+    # Initialize the database
+    init_db()
+
+    # Make fund management functions available in the global namespace
+    globals().update({
+        'init_db': init_db,
+        'create_fund': create_fund,
+        'buy_shares': buy_shares,
+        'sell_shares': sell_shares,
+        'get_fund_composition': get_fund_composition,
+        'update_fund': update_fund,
+        'update_all_funds': update_all_funds,
+        'fetch_live_price': fetch_live_price
+    })
+
+    print("Fund management tools initialized successfully!")
+""")
+
+# Matches <execute>...</execute> blocks (an unterminated block runs to the end)
+_EXECUTE_RE = re.compile(r"<execute>(.*?)(?:</execute>|$)", re.DOTALL)
+_EXECUTE_START = "<execute>"
+_EXECUTE_END = "</execute>"
+
+# How long a single iopub poll blocks, and the overall budget for one execution
+_IOPUB_POLL_TIMEOUT = 0.1
+_EXECUTION_TIMEOUT = 120
+
+def _rich_output_text(content):
+    return content['data'].get('text/plain')
+
+# iopub message type -> function extracting the text to report from its content
+_IOPUB_OUTPUT_HANDLERS = {
+    'stream': lambda content: content['text'],
+    'execute_result': _rich_output_text,
+    'display_data': _rich_output_text,
+    'error': lambda content: '\n'.join(content['traceback']),
+}
+
+def _json_line(obj) -> bytes:
+    """Serializes `obj` as one JSON-Lines record (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return json.dumps(obj).encode("utf-8") + b"\n"
+
+class _ExecuteBlockTracker:
+    """
+    Follows a streamed completion token by token and records where its
+    <execute> block starts and ends, so the code can be sliced out once the
+    stream is done instead of re-scanning the whole completion with a regex.
+    """
+    # Enough trailing characters to catch a tag split across two tokens
+    _TAIL = max(len(_EXECUTE_START), len(_EXECUTE_END)) - 1
+
+    def __init__(self):
+        self._parts = []
+        self._length = 0
+        self._tail = ""
+        self._code_start = None
+        self._code_end = None
+
+    def feed(self, token):
+        # `window` is the tail of the text seen so far plus the new token;
+        # `offset` is the position of window[0] in the full completion
+        window = self._tail + token
+        offset = self._length - len(self._tail)
+        self._parts.append(token)
+        self._length += len(token)
+
+        if self._code_start is None:
+            i = window.find(_EXECUTE_START)
+            if i != -1:
+                self._code_start = offset + i + len(_EXECUTE_START)
+                window = window[i + len(_EXECUTE_START):]
+                offset = self._code_start
+        if self._code_start is not None and self._code_end is None:
+            j = window.find(_EXECUTE_END)
+            if j != -1:
+                self._code_end = offset + j
+        self._tail = window[-self._TAIL:]
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def code_blocks(self, text):
+        """Returns the code of the tracked block within `text` (the joined stream)."""
+        if self._code_start is None:
+            return []
+        return [text[self._code_start:self._code_end]]
+
 class ClientJupyterKernel:
     def __init__(self, url=None, conv_id=None):
         self.conv_id = conv_id
@@ -76,54 +193,16 @@ class ClientJupyterKernel:
             print(f"ClientJupyterKernel initialized for conversation {conv_id}")
             print(f"Kernel started with id: {self.kernel_manager.kernel_id}")
             
-            init_code = textwrap.dedent("""
-                import os
-                import sys
-
-                # Use the parent directory as the project root (assuming this script is in 'agent')
-                project_root = os.path.abspath(os.path.join(os.getcwd(), ".."))
-                if project_root not in sys.path:
-                    sys.path.insert(0, project_root)
-                os.chdir(project_root)
-
-                from fund_manager.fund_manager import (
-                    init_db,
-                    create_fund,
-                    buy_shares,
-                    sell_shares,
-                    get_fund_composition,
-                    update_fund,
-                    update_all_funds
-                )
-                from fund_manager.yfinance_utils import fetch_live_price
-
-                # Initialize the database
-                init_db()
-
-                # Make fund management functions available in the global namespace
-                globals().update({
-                    'init_db': init_db,
-                    'create_fund': create_fund,
-                    'buy_shares': buy_shares,
-                    'sell_shares': sell_shares,
-                    'get_fund_composition': get_fund_composition,
-                    'update_fund': update_fund,
-                    'update_all_funds': update_all_funds,
-                    'fetch_live_price': fetch_live_price
-                })
-
-                print("Fund management tools initialized successfully!")
-            """)
-
-            self.execute(init_code)
+            self.execute(_INIT_CODE)
             
         except Exception as e:
             print(f"Error initializing kernel: {e}")
             raise
 
-    def execute(self, code):
+    def execute(self, code, timeout=_EXECUTION_TIMEOUT):
         """
         Execute Python code in the Jupyter kernel and capture the output.
+        If the kernel is still busy and silent `timeout` seconds in, it is interrupted.
         """
         try:
             if not code:
@@ -132,34 +211,35 @@ class ClientJupyterKernel:
             msg_id = self.client.execute(code)
             outputs = []
 
+            get_iopub_msg = self.client.get_iopub_msg
+            handlers = _IOPUB_OUTPUT_HANDLERS
+            deadline = time.monotonic() + timeout
+
             while True:
                 try:
-                    msg = self.client.get_iopub_msg(timeout=20)
-                    msg_type = msg['header']['msg_type']
-                    parent_id = msg['parent_header'].get('msg_id')
-
-                    if parent_id != msg_id:
-                        continue
-
-                    if msg_type == 'execute_input':
-                        continue
-                    elif msg_type == 'status':
-                        if msg['content']['execution_state'] == 'idle':
-                            break
-                    elif msg_type == 'stream':
-                        outputs.append(msg['content']['text'])
-                    elif msg_type == 'execute_result':
-                        if 'text/plain' in msg['content']['data']:
-                            outputs.append(msg['content']['data']['text/plain'])
-                    elif msg_type == 'error':
-                        error_msg = '\n'.join(msg['content']['traceback'])
-                        outputs.append(error_msg)
-                    elif msg_type == 'display_data':
-                        if 'text/plain' in msg['content']['data']:
-                            outputs.append(msg['content']['data']['text/plain'])
+                    msg = get_iopub_msg(timeout=_IOPUB_POLL_TIMEOUT)
                 except Empty:
-                    print("Timeout waiting for kernel output")
-                    break
+                    if time.monotonic() >= deadline:
+                        print("Timeout waiting for kernel output")
+                        self.kernel_manager.interrupt_kernel()
+                        break
+                    continue
+
+                if msg['parent_header'].get('msg_id') != msg_id:
+                    continue
+
+                msg_type = msg['header']['msg_type']
+                content = msg['content']
+                if msg_type == 'status':
+                    if content['execution_state'] == 'idle':
+                        break
+                    continue
+
+                handler = handlers.get(msg_type)
+                if handler is not None:
+                    text = handler(content)
+                    if text is not None:
+                        outputs.append(text)
 
             result = '\n'.join(outputs)
             return result if result else "Execution completed with no output"
@@ -211,19 +291,24 @@ class Generator:
                     stream=True
                 )
 
-                full_text = ""
+                parts = []
+                tail = ""
                 for chunk in response:
                     if chunk.choices and len(chunk.choices) > 0:
                         if chunk.choices[0].delta.content is not None:
                             token = chunk.choices[0].delta.content
-                            full_text += token
+                            parts.append(token)
                             yield token
 
-                            # If we see the closing tag, stop early.
-                            if "</execute>" in full_text:
+                            # If we see the closing tag, stop early. The tag can
+                            # only complete inside the new token plus the few
+                            # characters before it, so only that tail is scanned.
+                            window = tail + token
+                            if _EXECUTE_END in window:
                                 break
+                            tail = window[-(len(_EXECUTE_END) - 1):]
 
-                return full_text
+                return "".join(parts)
 
             else:
                 response = client.chat.completions.create(
@@ -256,9 +341,8 @@ class Agent:
         conv_id: str = None,
         **kwargs,
     ):
-        self.messages = [
-            {"role": "system", "content": system_message},
-        ]
+        self.messages = []
+        self._log_fp = None
         self.kwargs = {
             "stop_sequences": ["<|im_end|>"],
             "do_sample": False,
@@ -268,8 +352,25 @@ class Agent:
         self.generator = generator
         self.code_executor = code_executor
         self.conv_id = conv_id
+        self.append_message({"role": "system", "content": system_message})
         self.print_message(self.messages[0])
 
+    def append_message(self, message):
+        """
+        Adds `message` to the conversation and appends it to the
+        conv_data/<conv_id>.jsonl log, so the history survives a crash
+        without rewriting the whole conversation each turn.
+        """
+        self.messages.append(message)
+        try:
+            if self._log_fp is None:
+                pathlib.Path("conv_data").mkdir(exist_ok=True)
+                self._log_fp = open(f"conv_data/{self.conv_id}.jsonl", "ab")
+            self._log_fp.write(_json_line(message))
+            self._log_fp.flush()
+        except Exception as e:
+            print(f"Error logging message: {e}")
+
     def print_message(self, message):
         try:
             print("-" * 20)
@@ -284,13 +385,18 @@ class Agent:
         except Exception as e:
             print(f"Error printing message: {e}")
 
-    def handle_execution(self, completion: str, code_executor: ClientJupyterKernel):
+    def handle_execution(self, completion: str, code_executor: ClientJupyterKernel, code_blocks=None):
+        """
+        Runs the <execute> blocks of `completion`. `code_blocks` can provide
+        the already extracted code (e.g. from streaming) to skip parsing.
+        """
         try:
-            code_blocks = re.finditer(r"<execute>(.*?)(?:</execute>|$)", completion, re.DOTALL)
+            if code_blocks is None:
+                code_blocks = [match.group(1) for match in _EXECUTE_RE.finditer(completion)]
             results = []
 
-            for match in code_blocks:
-                code = match.group(1).strip()
+            for code in code_blocks:
+                code = code.strip()
                 if code:
                     result = code_executor.execute(code)
                     results.append(result)
@@ -302,7 +408,7 @@ class Agent:
 
     def handle_user_message(self, message, n_max_executions=10):
         try:
-            self.messages.append({"role": "user", "content": message})
+            self.append_message({"role": "user", "content": message})
             self.print_message(self.messages[-1])
 
             execution_count = 0
@@ -313,27 +419,32 @@ class Agent:
                     stream=True
                 )
 
-                full_text = ""
+                code_blocks = None
                 if hasattr(response_stream, "__iter__"):
                     print("-" * 20)
                     print(colored("ASSISTANT", self.COLOR_MAP.get("assistant", "blue"), attrs=["bold"]))
+                    tracker = _ExecuteBlockTracker()
                     for token in response_stream:
                         print(colored(token, self.COLOR_MAP.get("assistant", "blue")), end="", flush=True)
-                        full_text += token
+                        tracker.feed(token)
                     print()
+                    full_text = tracker.text
+                    code_blocks = tracker.code_blocks(full_text)
                 else:
                     full_text = response_stream or ""
                     self.print_message({"role": "assistant", "content": full_text})
 
-                self.messages.append({"role": "assistant", "content": full_text})
-                execution_output = self.handle_execution(full_text, self.code_executor)
+                self.append_message({"role": "assistant", "content": full_text})
+                execution_output = self.handle_execution(
+                    full_text, self.code_executor, code_blocks=code_blocks
+                )
                 if execution_output is not None:
                     execution_count += 1
                     execution_message = {
                         "role": "user",
                         "content": f"Execution Output:\n{execution_output}"
                     }
-                    self.messages.append(execution_message)
+                    self.append_message(execution_message)
                     self.print_message({"role": "execution_output", "content": execution_output})
 
             if execution_count == n_max_executions:
@@ -341,7 +452,7 @@ class Agent:
                     "role": "assistant",
                     "content": f"I have reached the maximum number of executions (n_max_executions={n_max_executions}). Can you assist me or ask me another question?"
                 }
-                self.messages.append(max_executions_message)
+                self.append_message(max_executions_message)
                 self.print_message(max_executions_message)
 
         except Exception as e:
@@ -366,6 +477,10 @@ class Agent:
             self.code_executor.shutdown()
 
     def save(self):
+        """Writes a consolidated JSON snapshot and closes the message log."""
+        if self._log_fp is not None:
+            self._log_fp.close()
+            self._log_fp = None
         try:
             pathlib.Path("conv_data").mkdir(exist_ok=True)
             path = f"conv_data/{self.conv_id}.json"
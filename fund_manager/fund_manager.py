@@ -1,19 +1,154 @@
 # fund_manager/fund_manager.py
 
-from datetime import datetime
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex, CreateTable
 
-from .db import get_session, get_engine, Base
+from .db import session_scope, get_engine, Base
 from .models import Fund, FundPosition, FundValuation, Operation
-from .yfinance_utils import fetch_live_price
+from .yfinance_utils import fetch_live_price, fetch_live_prices
+
+
+def _schema_version(dialect):
+    """
+    Returns a positive 31-bit hash of the DDL the models compile to on
+    `dialect`, so any change to a table or index yields a new version.
+    """
+    ddl = [str(CreateTable(table).compile(dialect=dialect)) for table in Base.metadata.sorted_tables]
+    ddl += [
+        str(CreateIndex(index).compile(dialect=dialect))
+        for table in Base.metadata.sorted_tables
+        for index in sorted(table.indexes, key=lambda index: index.name)
+    ]
+    digest = hashlib.blake2b("\n".join(ddl).encode(), digest_size=4).digest()
+    return int.from_bytes(digest, "big") & 0x7FFFFFFF or 1
+
+
+def _create_schema(connection):
+    """
+    Creates all tables and indexes that do not exist yet, on `connection`.
+    On SQLite the schema's hash is stored in PRAGMA user_version, and the
+    DDL is skipped entirely when the database already matches the models.
+    """
+    version = None
+    if connection.dialect.name == "sqlite":
+        version = _schema_version(connection.dialect)
+        if connection.exec_driver_sql("PRAGMA user_version").scalar() == version:
+            return
+
+    Base.metadata.create_all(connection)
+
+    # create_all skips tables that already exist, so add any index
+    # introduced after the database was first created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+    if version is not None:
+        # PRAGMA values cannot be bound parameters; version is an int
+        connection.exec_driver_sql(f"PRAGMA user_version = {version}")
+
+
+def init_db(bind=None):
+    """
+    Creates all tables and indexes (if they do not exist). Call this once on startup.
+    `bind` may be an Engine or a Connection to run the DDL on; by default the
+    shared engine is used, and its pooled connection is then reused by the
+    operations that follow.
+    """
+    if isinstance(bind, Connection):
+        _create_schema(bind)
+        return
 
+    # One connection and one transaction for all the DDL
+    with (bind or get_engine()).begin() as connection:
+        _create_schema(connection)
 
-def init_db():
+
+# Statements for the hot per-call lookups, built once with bound parameters
+# so every call reuses the engine's compiled-statement cache entry
+_FUND_BY_NAME = select(Fund).where(Fund.name == bindparam("fund_name"))
+_POSITION_BY_TICKER = select(FundPosition).where(
+    FundPosition.fund_id == bindparam("fund_id"),
+    FundPosition.ticker == bindparam("ticker")
+)
+
+
+def _get_fund(session, fund_name):
+    """
+    Returns the Fund named `fund_name`.
+    Raises ValueError if it does not exist.
+    """
+    fund = session.execute(_FUND_BY_NAME, {"fund_name": fund_name}).scalar_one_or_none()
+    if not fund:
+        raise ValueError(f"Fund {fund_name} does not exist.")
+    return fund
+
+
+def _held_positions(session, *criteria):
+    """
+    Returns the positions still held (shares_held > 0) matching `criteria`,
+    as lightweight read-only rows of (fund_id, ticker, shares_held,
+    last_purchase_price, last_purchase_date) rather than ORM instances.
     """
-    Creates all tables (if they do not exist). Call this once on startup.
+    stmt = select(
+        FundPosition.fund_id,
+        FundPosition.ticker,
+        FundPosition.shares_held,
+        FundPosition.last_purchase_price,
+        FundPosition.last_purchase_date
+    ).where(FundPosition.shares_held > 0, *criteria)
+    return session.execute(stmt).all()
+
+
+def _portfolio_value(cash, shares, prices):
+    """
+    Returns cash plus the market value of the given positions,
+    where `shares` and `prices` are aligned float64 arrays.
+    """
+    return cash + float(np.dot(shares, prices))
+
+
+def _compute_valuation(cash, positions, price_map):
     """
-    engine = get_engine()
-    Base.metadata.create_all(engine)
+    Returns the total value of a fund (cash + market value of its held
+    `positions`), using prices looked up in `price_map` (ticker -> price).
+    """
+    shares = np.fromiter(
+        (pos.shares_held for pos in positions), dtype=np.float64, count=len(positions)
+    )
+    prices = np.fromiter(
+        (price_map[pos.ticker] for pos in positions), dtype=np.float64, count=len(positions)
+    )
+    return _portfolio_value(cash, shares, prices)
+
+
+def _update_fund(session, fund, positions, price_map, now):
+    """
+    Stores a valuation snapshot for `fund` holding `positions`, priced
+    with `price_map`, and refreshes its last_update timestamp to `now`.
+    Returns (total_value, positions_with_prices), the latter being a list
+    of (position, price) pairs for every held position.
+    """
+    positions_with_prices = [(pos, price_map[pos.ticker]) for pos in positions]
+    total_value = _compute_valuation(fund.current_cash, positions, price_map)
+
+    # Create a new valuation record
+    valuation = FundValuation(
+        fund_id=fund.id,
+        valuation_date=now,
+        total_value=total_value
+    )
+    session.add(valuation)
+
+    fund.last_update = now
+    return total_value, positions_with_prices
 
 
 def create_fund(fund_name, initial_cash):
@@ -21,37 +156,38 @@ def create_fund(fund_name, initial_cash):
     Creates a new fund with the given name and starting cash.
     Raises ValueError if a fund with the name already exists.
     """
-    session = get_session()
+    now = datetime.now(timezone.utc)
     try:
-        new_fund = Fund(
-            name=fund_name,
-            current_cash=initial_cash
-        )
-        session.add(new_fund)
-        session.commit()
-
-        # Log creation operation
-        op = Operation(
-            fund_id=new_fund.id,
-            operation_type="CREATE",
-            shares=0.0,
-            price=0.0
-        )
-        session.add(op)
+        with session_scope() as session:
+            new_fund = Fund(
+                name=fund_name,
+                creation_date=now,
+                current_cash=initial_cash,
+                last_update=now
+            )
+            session.add(new_fund)
+            session.flush()
+
+            # Log creation operation
+            op = Operation(
+                fund_id=new_fund.id,
+                operation_type="CREATE",
+                shares=0.0,
+                price=0.0,
+                operation_date=now
+            )
+            session.add(op)
 
-        # Log initial valuation
-        val = FundValuation(
-            fund_id=new_fund.id,
-            total_value=initial_cash
-        )
-        session.add(val)
-        session.commit()
+            # Log initial valuation
+            val = FundValuation(
+                fund_id=new_fund.id,
+                valuation_date=now,
+                total_value=initial_cash
+            )
+            session.add(val)
 
     except IntegrityError:
-        session.rollback()
         raise ValueError(f"Fund with name '{fund_name}' already exists.")
-    finally:
-        session.close()
 
 
 def buy_shares(fund_name, ticker, num_shares):
@@ -60,11 +196,9 @@ def buy_shares(fund_name, ticker, num_shares):
     Deducts from fund's cash and updates position.
     Raises ValueError if insufficient cash or fund not found.
     """
-    session = get_session()
-    try:
-        fund = session.query(Fund).filter_by(name=fund_name).one_or_none()
-        if not fund:
-            raise ValueError(f"Fund {fund_name} does not exist.")
+    now = datetime.now(timezone.utc)
+    with session_scope() as session:
+        fund = _get_fund(session, fund_name)
 
         # Fetch current market price
         current_price = fetch_live_price(ticker)
@@ -80,10 +214,9 @@ def buy_shares(fund_name, ticker, num_shares):
         fund.current_cash -= total_cost
 
         # Update or create position
-        position = session.query(FundPosition).filter_by(
-            fund_id=fund.id,
-            ticker=ticker
-        ).one_or_none()
+        position = session.execute(
+            _POSITION_BY_TICKER, {"fund_id": fund.id, "ticker": ticker}
+        ).scalar_one_or_none()
 
         if not position:
             position = FundPosition(
@@ -91,7 +224,7 @@ def buy_shares(fund_name, ticker, num_shares):
                 ticker=ticker,
                 shares_held=num_shares,
                 last_purchase_price=current_price,
-                last_purchase_date=datetime.utcnow()
+                last_purchase_date=now
             )
             session.add(position)
         else:
@@ -107,7 +240,7 @@ def buy_shares(fund_name, ticker, num_shares):
 
             position.shares_held += num_shares
             position.last_purchase_price = weighted_price
-            position.last_purchase_date = datetime.utcnow()
+            position.last_purchase_date = now
 
         # Log the BUY operation
         op = Operation(
@@ -115,14 +248,12 @@ def buy_shares(fund_name, ticker, num_shares):
             ticker=ticker,
             operation_type="BUY",
             shares=num_shares,
-            price=current_price
+            price=current_price,
+            operation_date=now
         )
         session.add(op)
 
-        fund.last_update = datetime.utcnow()
-        session.commit()
-    finally:
-        session.close()
+        fund.last_update = now
 
 
 def sell_shares(fund_name, ticker, num_shares):
@@ -131,16 +262,13 @@ def sell_shares(fund_name, ticker, num_shares):
     Adds proceeds to fund's cash and updates position.
     Raises ValueError if insufficient shares or fund not found.
     """
-    session = get_session()
-    try:
-        fund = session.query(Fund).filter_by(name=fund_name).one_or_none()
-        if not fund:
-            raise ValueError(f"Fund {fund_name} does not exist.")
+    now = datetime.now(timezone.utc)
+    with session_scope() as session:
+        fund = _get_fund(session, fund_name)
 
-        position = session.query(FundPosition).filter_by(
-            fund_id=fund.id,
-            ticker=ticker
-        ).one_or_none()
+        position = session.execute(
+            _POSITION_BY_TICKER, {"fund_id": fund.id, "ticker": ticker}
+        ).scalar_one_or_none()
         if not position or position.shares_held < num_shares:
             available = position.shares_held if position else 0
             raise ValueError(
@@ -161,14 +289,12 @@ def sell_shares(fund_name, ticker, num_shares):
             ticker=ticker,
             operation_type="SELL",
             shares=num_shares,
-            price=current_price
+            price=current_price,
+            operation_date=now
         )
         session.add(op)
 
-        fund.last_update = datetime.utcnow()
-        session.commit()
-    finally:
-        session.close()
+        fund.last_update = now
 
 
 def update_fund(fund_name):
@@ -176,94 +302,100 @@ def update_fund(fund_name):
     Explicitly updates the fund by fetching the latest prices
     and storing a snapshot in fund_valuations.
     """
-    session = get_session()
-    try:
-        fund = session.query(Fund).filter_by(name=fund_name).one_or_none()
-        if not fund:
-            raise ValueError(f"Fund {fund_name} does not exist.")
-
-        total_value = fund.current_cash
-        positions = session.query(FundPosition).filter_by(fund_id=fund.id).all()
-
-        for pos in positions:
-            if pos.shares_held > 0:
-                price = fetch_live_price(pos.ticker)
-                total_value += price * pos.shares_held
-
-        # Create a new valuation record
-        valuation = FundValuation(
-            fund_id=fund.id,
-            total_value=total_value
-        )
-        session.add(valuation)
+    now = datetime.now(timezone.utc)
+    with session_scope() as session:
+        fund = _get_fund(session, fund_name)
 
-        fund.last_update = datetime.utcnow()
-        session.commit()
-    finally:
-        session.close()
+        positions = _held_positions(session, FundPosition.fund_id == fund.id)
+        price_map = fetch_live_prices(pos.ticker for pos in positions)
+        _update_fund(session, fund, positions, price_map, now)
 
 
-def update_all_funds():
+def update_all_funds(session=None):
     """
     Updates all funds in the database by fetching the latest prices for each position
     and creating a valuation snapshot for each fund.
+    Runs on `session` when given (committing it once at the end, unless it
+    belongs to an enclosing session_scope, which then owns the commit),
+    otherwise in its own session scope.
     """
-    session = get_session()
-    try:
-        funds = session.query(Fund).all()
-        for fund in funds:
-            total_value = fund.current_cash
-            positions = session.query(FundPosition).filter_by(fund_id=fund.id).all()
-            for pos in positions:
-                if pos.shares_held > 0:
-                    price = fetch_live_price(pos.ticker)
-                    total_value += price * pos.shares_held
-
-            # Create a new valuation record for this fund
-            valuation = FundValuation(
-                fund_id=fund.id,
-                total_value=total_value
-            )
-            session.add(valuation)
-            fund.last_update = datetime.utcnow()
-
-        session.commit()
-    finally:
-        session.close()
+    if session is None:
+        with session_scope() as session:
+            _update_all_funds(session)
+    else:
+        _update_all_funds(session)
+        if session.info.get("scope_depth", 0) == 0:
+            session.commit()
+
+
+def _update_all_funds(session):
+    # Read phase: plain SELECTs take no SQLite write lock, so nothing is
+    # held while waiting on the network for prices
+    funds = session.execute(select(Fund.id, Fund.current_cash)).all()
+    if not funds:
+        return
+
+    # Load every held position once, grouped by fund
+    positions_by_fund = defaultdict(list)
+    for pos in _held_positions(session):
+        positions_by_fund[pos.fund_id].append(pos)
+
+    # Fetch every held ticker across all funds in one batch
+    price_map = fetch_live_prices(
+        pos.ticker
+        for positions in positions_by_fund.values()
+        for pos in positions
+    )
+
+    # Write phase: all valuation records in one executemany INSERT
+    # (no per-object ORM events), then every fund stamped by one UPDATE
+    now = datetime.now(timezone.utc)
+    session.bulk_insert_mappings(
+        FundValuation,
+        [
+            {
+                "fund_id": fund.id,
+                "valuation_date": now,
+                "total_value": _compute_valuation(
+                    fund.current_cash, positions_by_fund[fund.id], price_map
+                )
+            }
+            for fund in funds
+        ]
+    )
+    session.execute(
+        update(Fund)
+        .where(Fund.id.in_([fund.id for fund in funds]))
+        .values(last_update=now)
+    )
 
 
 def get_fund_composition(fund_name):
     """
     Returns a dict with up-to-date info about the fund's composition.
-    Internally calls update_fund to ensure we have a fresh snapshot.
+    Also stores a fresh valuation snapshot, like update_fund.
     """
-    # Update the fund first to record historical snapshot
-    update_fund(fund_name)
-
-    session = get_session()
-    try:
-        fund = session.query(Fund).filter_by(name=fund_name).one_or_none()
-        if not fund:
-            raise ValueError(f"Fund {fund_name} does not exist.")
+    now = datetime.now(timezone.utc)
+    with session_scope() as session:
+        fund = _get_fund(session, fund_name)
+
+        positions = _held_positions(session, FundPosition.fund_id == fund.id)
+        price_map = fetch_live_prices(pos.ticker for pos in positions)
+        # Record the historical snapshot and reuse its computed values
+        total_value, positions_with_prices = _update_fund(
+            session, fund, positions, price_map, now
+        )
 
         composition = []
-        total_value = fund.current_cash
-
-        positions = session.query(FundPosition).filter_by(fund_id=fund.id).all()
-        for pos in positions:
-            if pos.shares_held > 0:
-                current_price = fetch_live_price(pos.ticker)
-                market_val = current_price * pos.shares_held
-                total_value += market_val
-
-                composition.append({
-                    "ticker": pos.ticker,
-                    "shares_held": pos.shares_held,
-                    "market_price": current_price,
-                    "last_purchase_price": pos.last_purchase_price,
-                    "last_purchase_date": pos.last_purchase_date,
-                    "market_value": market_val
-                })
+        for pos, current_price in positions_with_prices:
+            composition.append({
+                "ticker": pos.ticker,
+                "shares_held": pos.shares_held,
+                "market_price": current_price,
+                "last_purchase_price": pos.last_purchase_price,
+                "last_purchase_date": pos.last_purchase_date,
+                "market_value": current_price * pos.shares_held
+            })
 
         return {
             "fund_name": fund.name,
@@ -271,5 +403,3 @@ def get_fund_composition(fund_name):
             "positions": composition,
             "total_value": total_value
         }
-    finally:
-        session.close()
@@ -1,11 +1,15 @@
 # fund_manager/models.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from datetime import datetime, timezone
 
 from .db import Base
 
+def _utcnow():
+    """Timezone-aware replacement for the deprecated datetime.utcnow()."""
+    return datetime.now(timezone.utc)
+
 class Fund(Base):
     """
     Represents a single Fund with a unique name, current cash, etc.
@@ -14,13 +18,18 @@ class Fund(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
-    creation_date = Column(DateTime, default=datetime.utcnow)
+    creation_date = Column(DateTime, default=_utcnow)
     current_cash = Column(Float, default=0.0)
-    last_update = Column(DateTime, default=datetime.utcnow)
+    last_update = Column(DateTime, default=_utcnow)
 
     # Relationships
     positions = relationship("FundPosition", back_populates="fund", cascade="all, delete-orphan")
-    valuations = relationship("FundValuation", back_populates="fund", cascade="all, delete-orphan")
+    valuations = relationship(
+        "FundValuation",
+        back_populates="fund",
+        cascade="all, delete-orphan",
+        order_by="FundValuation.valuation_date"
+    )
     operations = relationship("Operation", back_populates="fund", cascade="all, delete-orphan")
 
 
@@ -29,13 +38,17 @@ class FundPosition(Base):
     Stores the position (shares held) in a particular ticker for a given fund.
     """
     __tablename__ = 'fund_positions'
+    __table_args__ = (
+        # One position per ticker per fund; also serves the (fund, ticker) lookups
+        Index("ix_pos_fund_ticker", "fund_id", "ticker", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     fund_id = Column(Integer, ForeignKey('funds.id'), nullable=False)
     ticker = Column(String, nullable=False)
     shares_held = Column(Float, default=0.0)
     last_purchase_price = Column(Float, default=0.0)
-    last_purchase_date = Column(DateTime, default=datetime.utcnow)
+    last_purchase_date = Column(DateTime, default=_utcnow)
 
     fund = relationship("Fund", back_populates="positions")
 
@@ -45,10 +58,15 @@ class FundValuation(Base):
     Tracks historical valuations of a fund each time an update is done.
     """
     __tablename__ = 'fund_valuations'
+    __table_args__ = (
+        # Serves the per-fund history in date order and MAX(valuation_date)
+        # per fund; total_value is included so the plot reads stay in the index
+        Index("ix_fv_fund_date", "fund_id", "valuation_date", "total_value"),
+    )
 
     id = Column(Integer, primary_key=True)
     fund_id = Column(Integer, ForeignKey('funds.id'), nullable=False)
-    valuation_date = Column(DateTime, default=datetime.utcnow)
+    valuation_date = Column(DateTime, default=_utcnow)
     total_value = Column(Float, default=0.0)
 
     fund = relationship("Fund", back_populates="valuations")
@@ -61,11 +79,11 @@ class Operation(Base):
     __tablename__ = 'operations'
 
     id = Column(Integer, primary_key=True)
-    fund_id = Column(Integer, ForeignKey('funds.id'), nullable=False)
+    fund_id = Column(Integer, ForeignKey('funds.id'), nullable=False, index=True)
     ticker = Column(String, nullable=True)  # might be empty for 'CREATE' or other ops
     operation_type = Column(String, nullable=False)  # e.g., CREATE, BUY, SELL
     shares = Column(Float, default=0.0)
     price = Column(Float, default=0.0)
-    operation_date = Column(DateTime, default=datetime.utcnow)
+    operation_date = Column(DateTime, default=_utcnow)
 
     fund = relationship("Fund", back_populates="operations")
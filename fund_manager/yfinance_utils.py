@@ -1,16 +1,139 @@
 # fund_manager/yfinance_utils.py
 
+import threading
+import time
+
+import requests
 import yfinance as yf
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    # Recent yfinance releases only accept curl_cffi sessions
+    from curl_cffi import requests as curl_requests
+except ImportError:
+    curl_requests = None
+
+# How long (in seconds) a fetched price is reused before going back to yfinance.
+PRICE_CACHE_TTL = 60.0
+
+
+def _build_session():
+    """
+    Creates the HTTP session shared by every yfinance request, so keep-alive
+    connections (and their TLS handshakes) are reused across price fetches.
+    """
+    if curl_requests is not None:
+        return curl_requests.Session(impersonate="chrome")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_SESSION = _build_session()
+
+# ticker -> (price, time.monotonic() timestamp of the fetch)
+_price_cache = {}
+_price_cache_lock = threading.Lock()
+
+
+def _get_cached_price(ticker):
+    """
+    Returns the cached price for `ticker` if it is still fresh, else None.
+    Callers must hold `_price_cache_lock`.
+    """
+    entry = _price_cache.get(ticker)
+    if entry is not None and time.monotonic() - entry[1] < PRICE_CACHE_TTL:
+        return entry[0]
+    return None
+
+
+def clear_price_cache():
+    """
+    Drops all cached prices, forcing the next lookups to hit yfinance.
+    """
+    with _price_cache_lock:
+        _price_cache.clear()
+
 
 def fetch_live_price(ticker: str) -> float:
     """
     Fetches the current market price for a given ticker using yfinance.
     Returns the last available Close price.
+    Prices are cached for PRICE_CACHE_TTL seconds.
     """
-    ticker_data = yf.Ticker(ticker)
-    df = ticker_data.history(period="1d")
+    with _price_cache_lock:
+        cached = _get_cached_price(ticker)
+    if cached is not None:
+        return cached
+
+    ticker_data = yf.Ticker(ticker, session=_SESSION)
+    df = ticker_data.history(period="1d", interval="1d", prepost=False)
     if df.empty:
         raise ValueError(f"No market data returned for ticker: {ticker}")
-    # Use .iloc[-1] instead of [-1] to avoid the FutureWarning
-    last_close = df['Close'].iloc[-1]
-    return float(last_close)
+    # Read the last close straight from the underlying ndarray, bypassing
+    # Series indexing (and its deprecated integer-key fallback)
+    last_close = float(df['Close'].to_numpy()[-1])
+
+    with _price_cache_lock:
+        _price_cache[ticker] = (last_close, time.monotonic())
+    return last_close
+
+
+def fetch_live_prices(tickers) -> dict:
+    """
+    Fetches the current market price for several tickers at once.
+    Returns a dict mapping each ticker to its last available Close price.
+    Cached prices are reused; the remaining tickers are fetched in a single
+    batched yfinance download (fetched in parallel threads).
+    """
+    unique_tickers = sorted(set(tickers))
+    prices = {}
+    with _price_cache_lock:
+        for ticker in unique_tickers:
+            cached = _get_cached_price(ticker)
+            if cached is not None:
+                prices[ticker] = cached
+
+    missing = [ticker for ticker in unique_tickers if ticker not in prices]
+    if not missing:
+        return prices
+
+    df = yf.download(
+        tickers=" ".join(missing),
+        period="1d",
+        group_by="ticker",
+        threads=True,
+        progress=False,
+        session=_SESSION
+    )
+
+    fetched = {}
+    for ticker in missing:
+        # Columns are (ticker, field) when grouped, but older yfinance
+        # versions return flat columns for a single ticker. yf.download
+        # upper-cases the symbols it keys the columns by, while the result
+        # (and the cache) keep the caller's spelling.
+        try:
+            closes = df[ticker.upper()]['Close'] if df.columns.nlevels > 1 else df['Close']
+        except KeyError:
+            raise ValueError(f"No market data returned for ticker: {ticker}")
+        closes = closes.dropna()
+        if closes.empty:
+            raise ValueError(f"No market data returned for ticker: {ticker}")
+        fetched[ticker] = float(closes.iloc[-1])
+
+    now = time.monotonic()
+    with _price_cache_lock:
+        for ticker, price in fetched.items():
+            _price_cache[ticker] = (price, now)
+
+    prices.update(fetched)
+    return prices
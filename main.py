@@ -1,5 +1,7 @@
 # main.py
 
+from fund_manager.db import session_scope
+from fund_manager.yfinance_utils import fetch_live_prices
 from fund_manager.fund_manager import (
     init_db,
     create_fund,
@@ -19,11 +21,20 @@ def main():
     except Exception as e:
         print(e)
     
-    print("\nBuying 10 shares of AAPL ...")
-    buy_shares(fund_name, "AAPL", 10)
+    # Fetch both prices in one batch up front; buy_shares then reads them
+    # from the price cache, so no network wait happens while the block
+    # below holds SQLite's write lock.
+    fetch_live_prices(["AAPL", "TSLA"])
     
-    print("Buying 5 shares of TSLA ...")
-    buy_shares(fund_name, "TSLA", 5)
+    # Run the two buys as one transaction (committed once, or rolled back
+    # together). Only writes go in the block: the composition checks refresh
+    # prices and must not keep the lock held or undo the buys if they fail.
+    with session_scope():
+        print("\nBuying 10 shares of AAPL ...")
+        buy_shares(fund_name, "AAPL", 10)
+    
+        print("Buying 5 shares of TSLA ...")
+        buy_shares(fund_name, "TSLA", 5)
     
     print("\nGetting current composition:")
     composition = get_fund_composition(fund_name)
@@ -1,53 +1,63 @@
 # main_update_check.py
 
-import time
+import sys
+from sqlalchemy import func
 from fund_manager.fund_manager import init_db, update_all_funds
 from fund_manager.db import get_session
 from fund_manager.models import Fund, FundValuation
 
-def get_last_valuation_timestamp(fund_id, session):
+def get_last_valuation_timestamps(session):
     """
-    Returns the latest valuation timestamp for the given fund.
+    Returns a {fund_id: latest valuation timestamp} dict for every fund,
+    computed by a single GROUP BY query.
+    Funds without any valuation are absent from the dict.
     """
-    valuation = (
-        session.query(FundValuation)
-        .filter_by(fund_id=fund_id)
-        .order_by(FundValuation.valuation_date.desc())
-        .first()
+    return dict(
+        session.query(FundValuation.fund_id, func.max(FundValuation.valuation_date))
+        .group_by(FundValuation.fund_id)
+        .all()
     )
-    return valuation.valuation_date if valuation else None
 
-def check_new_valuation():
+def check_new_valuation(verbose=True):
+    """
+    Updates all funds and reports, per fund, whether a new valuation record
+    was appended. Each report is written to stdout in one call; with
+    verbose=False nothing is formatted or printed.
+    """
     session = get_session()
     try:
         # Retrieve each fund's last valuation timestamp before the update.
-        funds = session.query(Fund).all()
-        before_timestamps = {}
-        print("=== Before Update ===")
-        for fund in funds:
-            last_ts = get_last_valuation_timestamp(fund.id, session)
-            before_timestamps[fund.id] = last_ts
-            print(f"Fund: {fund.name} | Last Valuation Timestamp: {last_ts}")
-        
-        # Wait briefly to ensure the new timestamps will differ.
-        time.sleep(2)
+        funds = session.query(Fund.id, Fund.name).all()
+        before_timestamps = get_last_valuation_timestamps(session)
+        if verbose:
+            lines = ["=== Before Update ==="]
+            for fund_id, name in funds:
+                lines.append(f"Fund: {name} | Last Valuation Timestamp: {before_timestamps.get(fund_id)}")
+            lines.append("\nUpdating all funds...\n")
+            sys.stdout.write("\n".join(lines) + "\n")
         
-        # Update all funds (each update adds a new valuation record).
-        print("\nUpdating all funds...\n")
-        update_all_funds()
+        # Update all funds (each update adds a new valuation record stamped
+        # with a fresh valuation_date, so a strict `>` against the timestamps
+        # captured above detects it without waiting for the clock to move).
+        update_all_funds(session)
         
         # Retrieve and display updated timestamps.
-        print("=== After Update ===")
-        funds = session.query(Fund).all()  # re-query to get latest data
-        for fund in funds:
-            new_ts = get_last_valuation_timestamp(fund.id, session)
-            print(f"Fund: {fund.name} | New Last Valuation Timestamp: {new_ts}")
-            if before_timestamps[fund.id] is None:
-                print(f"  -> No valuation existed before. New record added at {new_ts}")
-            elif new_ts > before_timestamps[fund.id]:
-                print(f"  -> New valuation record appended at {new_ts}")
-            else:
-                print("  -> No new valuation record detected.")
+        # The (id, name) rows from before are still valid; only the
+        # timestamps need to be fetched again
+        after_timestamps = get_last_valuation_timestamps(session)
+        if verbose:
+            lines = ["=== After Update ==="]
+            for fund_id, name in funds:
+                new_ts = after_timestamps.get(fund_id)
+                old_ts = before_timestamps.get(fund_id)
+                lines.append(f"Fund: {name} | New Last Valuation Timestamp: {new_ts}")
+                if old_ts is None:
+                    lines.append(f"  -> No valuation existed before. New record added at {new_ts}")
+                elif new_ts > old_ts:
+                    lines.append(f"  -> New valuation record appended at {new_ts}")
+                else:
+                    lines.append("  -> No new valuation record detected.")
+            sys.stdout.write("\n".join(lines) + "\n")
     finally:
         session.close()
 
@@ -1,47 +1,139 @@
 # plot_valuations.py
 
+import sys
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import matplotlib.colors as mcolors
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 from fund_manager.db import get_session
 from fund_manager.models import Fund, FundValuation
 
-def plot_valuations_curve():
+try:
+    from tsdownsample import MinMaxLTTBDownsampler
+except ImportError:
+    MinMaxLTTBDownsampler = None
+
+# Series longer than this are downsampled before plotting: a screen is only
+# ~1-2k pixels wide, so more vertices add drawing cost but no detail.
+MAX_POINTS_PER_FUND = 2000
+
+def downsample_indices(x, y, n_out):
+    """
+    Returns the sorted indices of the points to keep when reducing the
+    (x, y) series to about `n_out` points while preserving its shape.
+    Uses MinMaxLTTB from tsdownsample when installed, otherwise keeps the
+    first and last points plus the min and max of each bucket.
+    """
+    if MinMaxLTTBDownsampler is not None:
+        return MinMaxLTTBDownsampler().downsample(x, y, n_out=n_out)
+
+    keep = {0, len(y) - 1}
+    for bucket in np.array_split(np.arange(len(y)), n_out // 2):
+        keep.add(bucket[np.argmin(y[bucket])])
+        keep.add(bucket[np.argmax(y[bucket])])
+    return np.array(sorted(keep))
+
+def padded_limits(low, high, ratio=0.05):
+    """
+    Returns (low, high) widened by `ratio` of their span on each side,
+    or by a fixed amount when the span is zero (a single point or a flat line).
+    """
+    pad = (high - low) * ratio or abs(high) * ratio or 1.0
+    return low - pad, high + pad
+
+def plot_valuations_curve(output=None):
+    """
+    Plots every fund's valuation history. Shows the figure in a window,
+    or, when `output` is a file path, renders it headlessly (Agg) to that file.
+    """
+    if output is not None:
+        plt.switch_backend('Agg')
+
     session = get_session()
     try:
-        funds = session.query(Fund).all()
-        if not funds:
+        fund_names = dict(session.query(Fund.id, Fund.name).all())
+        if not fund_names:
             print("No funds available to plot.")
             return
+
+        # Load every fund's valuations in one Core query straight into
+        # DataFrame columns, ordered so that each fund's rows come out
+        # chronologically (the order the ix_fv_fund_date index is in)
+        df = pd.read_sql_query(
+            select(
+                FundValuation.fund_id,
+                FundValuation.valuation_date,
+                FundValuation.total_value
+            ).order_by(FundValuation.fund_id, FundValuation.valuation_date),
+            session.bind,
+            parse_dates=["valuation_date"]
+        )
+
+        # One (name, dates, values) series per fund, with the dates converted
+        # to matplotlib's float format in one vectorized call
+        series = []
+        for fund_id, group in df.groupby('fund_id', sort=False):
+            dates = mdates.date2num(group['valuation_date'].to_numpy())
+            values = group['total_value'].to_numpy()
+            if len(values) > MAX_POINTS_PER_FUND:
+                idx = downsample_indices(dates, values, MAX_POINTS_PER_FUND)
+                dates, values = dates[idx], values[idx]
+            series.append((fund_names[fund_id], dates, values))
+
+        fig, ax = plt.subplots(figsize=(12, 6))
+        # Limits are set from the data below, skipping autoscale traversals
+        ax.set_autoscale_on(False)
         
-        plt.figure(figsize=(12, 6))
-        
-        # Plot each fund's valuation curve
-        for fund in funds:
-            valuations = session.query(FundValuation)\
-                                .filter_by(fund_id=fund.id)\
-                                .order_by(FundValuation.valuation_date)\
-                                .all()
-            if not valuations:
-                continue
-            
-            dates = [val.valuation_date for val in valuations]
-            values = [val.total_value for val in valuations]
-            
-            plt.plot(dates, values, marker='o', linestyle='-', label=fund.name)
+        # Draw every fund's curve with a single collection (and all markers
+        # with a single scatter) instead of one Line2D per fund
+        cycle = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        colors = mcolors.to_rgba_array([cycle[i % len(cycle)] for i in range(len(series))])
+        if series:
+            ax.add_collection(LineCollection(
+                [np.column_stack((dates, values)) for _, dates, values in series],
+                colors=colors,
+                linestyles='-'
+            ))
+            all_dates = np.concatenate([dates for _, dates, _ in series])
+            all_values = np.concatenate([values for _, _, values in series])
+            ax.scatter(
+                all_dates,
+                all_values,
+                c=np.repeat(colors, [len(dates) for _, dates, _ in series], axis=0),
+                marker='o'
+            )
+            if len(all_dates):
+                ax.set_xlim(*padded_limits(all_dates.min(), all_dates.max()))
+                ax.set_ylim(*padded_limits(all_values.min(), all_values.max()))
         
-        plt.xlabel('Date')
-        plt.ylabel('Total Value ($)')
-        plt.title('Fund Valuations Over Time')
-        plt.legend()
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Total Value ($)')
+        ax.set_title('Fund Valuations Over Time')
+        ax.legend(handles=[
+            Line2D([], [], color=color, marker='o', linestyle='-', label=name)
+            for (name, _, _), color in zip(series, colors)
+        ])
         
-        # Format x-axis to display dates nicely.
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d %H:%M:%S'))
-        plt.gcf().autofmt_xdate()  # Auto-rotate date labels
+        # Format x-axis to display dates nicely: the concise formatter only
+        # spells out the parts of each tick that change between ticks.
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        ax.tick_params(axis='x', labelrotation=30)
         
-        plt.tight_layout()
-        plt.show()
+        fig.tight_layout()
+        if output is not None:
+            fig.savefig(output)
+            plt.close(fig)
+        else:
+            plt.show()
     finally:
         session.close()
 
 if __name__ == '__main__':
-    plot_valuations_curve()
+    plot_valuations_curve(sys.argv[1] if len(sys.argv) > 1 else None)